@@ -4,6 +4,7 @@ from core.agents.response import AgentResponse
 from core.config import get_config
 from core.db.models import ProjectState
 from core.llm.base import BaseLLMClient, LLMError
+from core.llm.cache import response_cache
 from core.log import get_logger
 from core.proc.process_manager import ProcessManager
 from core.state.state_manager import StateManager
@@ -150,7 +151,7 @@ class BaseAgent:
 
         return False
 
-    def get_llm(self, name=None, stream_output=False) -> Callable:
+    def get_llm(self, name=None, stream_output=False, cache_responses=False, handle_errors=True) -> Callable:
         """
         Get a new instance of the agent-specific LLM client.
 
@@ -159,7 +160,17 @@ class BaseAgent:
         can be overridden in case the agent needs to use a different
         model configuration.
 
+        Set `cache_responses` for deterministic requests whose responses
+        can be reused if the exact same request is made again (eg. when
+        retrying a step).
+
+        Unset `handle_errors` for optional requests, which should fail with
+        an `APIError` instead of asking the user whether to retry.
+
         :param name: Name of the agent for configuration (default: class name).
+        :param stream_output: Whether to stream the response to the UI.
+        :param cache_responses: Whether to reuse responses to identical requests.
+        :param handle_errors: Whether to let the user handle (retry) LLM errors.
         :return: LLM client for the agent.
         """
 
@@ -171,7 +182,12 @@ class BaseAgent:
         llm_config = config.llm_for_agent(name)
         client_class = BaseLLMClient.for_provider(llm_config.provider)
         stream_handler = self.stream_handler if stream_output else None
-        llm_client = client_class(llm_config, stream_handler=stream_handler, error_handler=self.error_handler)
+        llm_client = client_class(
+            llm_config,
+            stream_handler=stream_handler,
+            error_handler=self.error_handler if handle_errors else None,
+            response_cache=response_cache if cache_responses else None,
+        )
 
         async def client(convo, **kwargs) -> Any:
             """
@@ -1,16 +1,28 @@
+import asyncio
+import random
 import re
+from collections import Counter
 from difflib import unified_diff
 from enum import Enum
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Callable, Optional, Union
 
 from pydantic import BaseModel, Field
 
 from core.agents.base import BaseAgent
 from core.agents.convo import AgentConvo
 from core.agents.response import AgentResponse, ResponseType
-from core.config import CODE_MONKEY_AGENT_NAME, CODE_REVIEW_AGENT_NAME, DESCRIBE_FILES_AGENT_NAME
+from core.config import (
+    CODE_MONKEY_AGENT_NAME,
+    CODE_REVIEW_AGENT_NAME,
+    CODE_REVIEW_PRECHECK_AGENT_NAME,
+    DESCRIBE_FILES_AGENT_NAME,
+    get_config,
+)
+from core.llm.base import APIError
 from core.llm.parser import JSONParser, OptionalCodeBlockParser
 from core.log import get_logger
+from core.telemetry import telemetry
 
 log = get_logger(__name__)
 
@@ -27,6 +39,39 @@ MAX_REVIEW_RETRIES = 2
 # Maximum number of code implementation attempts after which we accept the changes unconditionaly
 MAX_CODING_ATTEMPTS = 3
 
+# Number of lines of the original file shown to the reviewer before and after each change
+REVIEW_CONTEXT_LINES = 20
+
+# Diffs with more hunks than this are split into batches of this size, reviewed in parallel
+REVIEW_BATCH_SIZE = 8
+
+# Maximum number of batches of a single diff reviewed at the same time (per agent, see MAX_PARALLEL_AGENTS)
+MAX_PARALLEL_REVIEW_BATCHES = 2
+
+# Changes with at most this many added and removed lines are trivial and accepted without review
+MAX_UNREVIEWED_CHANGED_LINES = 2
+
+# Maximum number of computed diffs kept in memory
+MAX_CACHED_DIFFS = 32
+
+# Fraction of hunks approved in the pre-check that are still sent to the full review, to keep the pre-check honest
+PRECHECK_AUDIT_RATE = 0.1
+
+
+@lru_cache(maxsize=MAX_CACHED_DIFFS)
+def _unified_diff(old_content: str, new_content: str) -> tuple[str, ...]:
+    """
+    Compute the unified diff lines (without the file name header) between two file versions.
+
+    Diffing is the most expensive part of processing large files, and the same
+    file versions are diffed both for the review and for the UI, so the result
+    is cached.
+    """
+    from_lines = old_content.splitlines(keepends=True)
+    to_lines = new_content.splitlines(keepends=True)
+    # Skip the prologue (file names)
+    return tuple(unified_diff(from_lines, to_lines))[2:]
+
 
 class Decision(str, Enum):
     APPLY = "apply"
@@ -45,6 +90,21 @@ class ReviewChanges(BaseModel):
     review_notes: str = Field(description="Additional review notes (optional, can be empty).")
 
 
+class PrecheckVerdict(str, Enum):
+    YES = "yes"
+    NO = "no"
+    UNSURE = "unsure"
+
+
+class HunkPrecheck(BaseModel):
+    number: int = Field(description="Index of the hunk in the diff. Starts from 1.")
+    verdict: PrecheckVerdict = Field(description="Whether the hunk is an obviously correct implementation.")
+
+
+class PrecheckChanges(BaseModel):
+    hunks: list[HunkPrecheck]
+
+
 class FileDescription(BaseModel):
     summary: str = Field(
         description="Detailed description summarized what the file is about, and what the major classes, functions, elements or other functionality is implemented."
@@ -54,6 +114,39 @@ class FileDescription(BaseModel):
     )
 
 
+class DiffStreamCheck:
+    """
+    Check that the LLM response being streamed looks like a diff.
+
+    Once the first line of the response (after the optional code block
+    start) is complete, check that it's a hunk header. If the LLM started
+    writing something else (most commonly the entire file), we won't be
+    able to use the response, so there's no point in waiting for the rest.
+    """
+
+    def __init__(self):
+        self.response = ""
+        self.done = False
+
+    def __call__(self, content: str) -> bool:
+        if self.done:
+            return True
+
+        self.response += content
+        lines = self.response.lstrip().split("\n")
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        # Skip blank lines after the code block start
+        while len(lines) > 1 and not lines[0].strip():
+            lines = lines[1:]
+        if len(lines) < 2:
+            # First line is not complete yet
+            return True
+
+        self.done = True
+        return lines[0].startswith(("@@", "---", "```"))
+
+
 class CodeMonkey(BaseAgent):
     agent_type = "code-monkey"
     display_name = "Code Monkey"
@@ -96,7 +189,7 @@ class CodeMonkey(BaseAgent):
         iterations = self.current_state.iterations
         user_feedback = None
         user_feedback_qa = None
-        llm = self.get_llm(CODE_MONKEY_AGENT_NAME)
+        llm = self.get_llm(CODE_MONKEY_AGENT_NAME, cache_responses=True)
 
         if iterations:
             last_iteration = iterations[-1]
@@ -106,23 +199,36 @@ class CodeMonkey(BaseAgent):
         else:
             instructions = self.current_state.current_task["instructions"]
 
-        convo = AgentConvo(self).template(
-            "implement_changes",
-            file_name=file_name,
-            file_content=file_content,
+        # The context (coding rules, project files, task instructions) is shared by all files
+        # changed in this step, so it goes first and unchanged to allow LLM prompt caching.
+        convo = AgentConvo(self).system_template(
+            "implement_changes_context",
             instructions=instructions,
             user_feedback=user_feedback,
             user_feedback_qa=user_feedback_qa,
         )
-        if feedback:
-            convo.assistant(f"```\n{data['new_content']}\n```\n").template(
-                "review_feedback",
-                content=data["approved_content"],
-                original_content=file_content,
-                rework_feedback=feedback,
+
+        response = None
+        if file_content and not feedback:
+            # Ask only for the changes instead of the entire file, to save on output tokens
+            response = await self.implement_changes_as_diff(llm, convo.fork(), file_name, file_content)
+
+        if response is None:
+            convo.template(
+                "implement_changes",
+                file_name=file_name,
+                file_content=file_content,
             )
+            if feedback:
+                convo.assistant(f"```\n{data['new_content']}\n```\n").template(
+                    "review_feedback",
+                    content=data["approved_content"],
+                    original_content=file_content,
+                    rework_feedback=feedback,
+                )
+
+            response: str = await llm(convo, temperature=0, parser=OptionalCodeBlockParser())
 
-        response: str = await llm(convo, temperature=0, parser=OptionalCodeBlockParser())
         # FIXME: provide a counter here so that we don't have an endless loop here
         return {
             "path": file_name,
@@ -132,6 +238,51 @@ class CodeMonkey(BaseAgent):
             "attempt": attempt,
         }
 
+    async def implement_changes_as_diff(
+        self,
+        llm: Callable,
+        convo: AgentConvo,
+        file_name: str,
+        file_content: str,
+    ) -> Optional[str]:
+        """
+        Implement the changes to an existing file by asking the LLM for a diff.
+
+        The diff is applied to the current file content locally. If the
+        LLM response isn't a valid diff for the file, None is returned
+        and the caller should ask for the complete file instead.
+
+        :param llm: LLM client to use.
+        :param convo: Conversation with the context for implementing the changes.
+        :param file_name: name of the file being modified
+        :param file_content: current file content
+        :return: new file content, or None if the diff couldn't be applied
+        """
+        convo.template(
+            "implement_changes_diff",
+            file_name=file_name,
+            file_content=file_content,
+        )
+        diff: str = await llm(
+            convo,
+            temperature=0,
+            parser=OptionalCodeBlockParser(),
+            stream_check=DiffStreamCheck(),
+        )
+
+        hunks = self.locate_diff_hunks(file_content, diff)
+        if hunks is None:
+            log.info(f"Can't apply the changes to {file_name} as diff, asking for the full file instead")
+            return None
+        if not hunks:
+            return file_content
+
+        try:
+            return self._apply_patch(file_content, "\n".join(hunks) + "\n")
+        except Exception as e:
+            log.info(f"Error applying diff to {file_name}: {e}, asking for the full file instead")
+            return None
+
     async def describe_files(self) -> AgentResponse:
         llm = self.get_llm(DESCRIBE_FILES_AGENT_NAME)
         to_describe = {
@@ -256,50 +407,42 @@ class CodeMonkey(BaseAgent):
         Diff hunk explanation: https://www.gnu.org/software/diffutils/manual/html_node/Hunks.html
         """
 
-        hunks = self.get_diff_hunks(file_name, old_content, new_content)
+        hunks = self.get_diff_hunks(old_content, new_content)
 
-        llm = self.get_llm(CODE_REVIEW_AGENT_NAME)
-        convo = (
-            self._get_task_convo()
-            .template(
-                "review_changes",
-                instructions=instructions,
-                file_name=file_name,
-                old_content=old_content,
-                hunks=hunks,
-            )
-            .require_schema(ReviewChanges)
+        n_changed_lines = sum(1 for hunk in hunks for line in hunk.splitlines()[1:] if line[:1] in ("+", "-"))
+        if n_changed_lines <= MAX_UNREVIEWED_CHANGED_LINES:
+            # Not worth the LLM round-trip
+            log.info(f"Skipping review of trivial change to {file_name} ({n_changed_lines} changed lines)")
+            telemetry.inc("num_skipped_reviews")
+            return new_content, None
+
+        preapproved = await self.precheck_hunks(file_name, instructions, hunks)
+        review = ReviewChanges(
+            hunks=[
+                Hunk(number=i + 1, reason="Approved in the pre-check.", decision=Decision.APPLY)
+                for i in sorted(preapproved)
+            ],
+            review_notes="",
         )
-        llm_response: ReviewChanges = await llm(convo, temperature=0, parser=JSONParser(ReviewChanges))
 
-        for i in range(MAX_REVIEW_RETRIES):
-            reasons = {}
-            ids_to_apply = set()
-            ids_to_ignore = set()
-            ids_to_rework = set()
-            for hunk in llm_response.hunks:
-                reasons[hunk.number - 1] = hunk.reason
-                if hunk.decision == "apply":
-                    ids_to_apply.add(hunk.number - 1)
-                elif hunk.decision == "ignore":
-                    ids_to_ignore.add(hunk.number - 1)
-                elif hunk.decision == "rework":
-                    ids_to_rework.add(hunk.number - 1)
+        review_ids = [i for i in range(len(hunks)) if i not in preapproved]
+        if review_ids:
+            llm_response = await self.review_hunks_in_batches(
+                file_name, instructions, old_content, [hunks[i] for i in review_ids]
+            )
+            if llm_response is None:
+                # If the reviewer still hasn't reviewed all hunks, we'll just use the entire new content
+                return new_content, None
+            # Map the reviewed hunks back to their position in the full diff
+            review.hunks.extend(
+                Hunk(number=review_ids[hunk.number - 1] + 1, reason=hunk.reason, decision=hunk.decision)
+                for hunk in llm_response.hunks
+            )
+            review.review_notes = llm_response.review_notes
 
-            n_hunks = len(hunks)
-            n_review_hunks = len(reasons)
-            if n_review_hunks == n_hunks:
-                break
-            elif n_review_hunks < n_hunks:
-                error = "Not all hunks have been reviewed. Please review all hunks and add 'apply', 'ignore' or 'rework' decision for each."
-            elif n_review_hunks > n_hunks:
-                error = f"Your review contains more hunks ({n_review_hunks}) than in the original diff ({n_hunks}). Note that one hunk may have multiple changed lines."
-
-            # Max two retries; if the reviewer still hasn't reviewed all hunks, we'll just use the entire new content
-            convo.assistant(llm_response.model_dump_json()).user(error)
-            llm_response = await llm(convo, parser=JSONParser(ReviewChanges))
-        else:
-            return new_content, None
+        reasons = {hunk.number - 1: hunk.reason for hunk in review.hunks}
+        ids_to_apply = {hunk.number - 1 for hunk in review.hunks if hunk.decision == Decision.APPLY}
+        ids_to_rework = {hunk.number - 1 for hunk in review.hunks if hunk.decision == Decision.REWORK}
 
         hunks_to_apply = [h for i, h in enumerate(hunks) if i in ids_to_apply]
         diff_log = f"--- {file_name}\n+++ {file_name}\n" + "\n".join(hunks_to_apply)
@@ -308,7 +451,7 @@ class CodeMonkey(BaseAgent):
         review_log = (
             "\n\n".join([f"## Change\n```{hunk}```\nReviewer feedback:\n{reasons[i]}" for (i, hunk) in hunks_to_rework])
             + "\n\nReview notes:\n"
-            + llm_response.review_notes
+            + review.review_notes
         )
 
         if len(hunks_to_apply) == len(hunks):
@@ -322,7 +465,7 @@ class CodeMonkey(BaseAgent):
             else:
                 # If everything can be safely ignored, it's probably because the files already implement the changes
                 # from previous tasks (which can happen often). Insisting on a change here is likely to cause problems.
-                log.info(f"Rejecting entire change to {file_name} with reason: {llm_response.review_notes}")
+                log.info(f"Rejecting entire change to {file_name} with reason: {review.review_notes}")
                 return old_content, None
 
         log.debug(f"Applying code change to {file_name}:\n{diff_log}")
@@ -333,6 +476,167 @@ class CodeMonkey(BaseAgent):
         else:
             return new_content, None
 
+    async def precheck_hunks(self, file_name: str, instructions: str, hunks: list[str]) -> set[int]:
+        """
+        Ask a smaller LLM to approve obviously correct hunks before the full review.
+
+        This is only done if the pre-check LLM is explicitly configured. Only the
+        hunks that the pre-check LLM is sure about are approved; everything else
+        (including a random sample of the approved hunks) goes to the full review.
+        If the pre-check fails, all hunks go to the full review.
+
+        :param file_name: name of the file being modified
+        :param instructions: instructions for the reviewer
+        :param hunks: diff hunks to check
+        :return: set of (0-based) indices of hunks that can be applied without full review
+        """
+        if CODE_REVIEW_PRECHECK_AGENT_NAME not in get_config().agent:
+            return set()
+
+        llm = self.get_llm(CODE_REVIEW_PRECHECK_AGENT_NAME, cache_responses=True, handle_errors=False)
+        convo = (
+            AgentConvo(self)
+            .template(
+                "precheck_changes",
+                instructions=instructions,
+                file_name=file_name,
+                hunks=hunks,
+            )
+            .require_schema(PrecheckChanges)
+        )
+        try:
+            llm_response: PrecheckChanges = await llm(
+                convo, temperature=0, parser=JSONParser(PrecheckChanges), max_retries=1
+            )
+        except APIError as err:
+            # The pre-check is only an optimization, the full review can handle all the hunks
+            log.warning(f"Pre-check of {file_name} failed, reviewing all hunks: {err.message}")
+            return set()
+
+        approved = {
+            hunk.number - 1
+            for hunk in llm_response.hunks
+            if hunk.verdict == PrecheckVerdict.YES and 0 < hunk.number <= len(hunks)
+        }
+        audited = {i for i in approved if random.random() < PRECHECK_AUDIT_RATE}
+        approved -= audited
+        log.debug(
+            f"Pre-check approved {len(approved)}/{len(hunks)} hunks in {file_name} ({len(audited)} sent for audit)"
+        )
+        return approved
+
+    async def review_hunks_in_batches(
+        self, file_name: str, instructions: str, old_content: str, hunks: list[str]
+    ) -> Optional[ReviewChanges]:
+        """
+        Ask the LLM to review the diff hunks, splitting large diffs into batches.
+
+        Smaller batches are faster to review (and to retry), and are reviewed
+        in parallel (at most MAX_PARALLEL_REVIEW_BATCHES at a time). If any of
+        the batches can't be reviewed, all the hunks are reviewed at once
+        instead.
+
+        :param file_name: name of the file being modified
+        :param instructions: instructions for the reviewer
+        :param old_content: old file content
+        :param hunks: diff hunks to review
+        :return: review of all the hunks, or None if the reviewer failed to review them all
+        """
+        if len(hunks) <= REVIEW_BATCH_SIZE:
+            return await self.review_hunks(file_name, instructions, old_content, hunks)
+
+        # Code monkeys already run in parallel, so keep the number of requests per agent bounded
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_REVIEW_BATCHES)
+
+        async def review_batch(offset: int) -> Optional[ReviewChanges]:
+            async with semaphore:
+                return await self.review_hunks(
+                    file_name, instructions, old_content, hunks[offset : offset + REVIEW_BATCH_SIZE]
+                )
+
+        offsets = range(0, len(hunks), REVIEW_BATCH_SIZE)
+        reviews = await asyncio.gather(*[review_batch(offset) for offset in offsets])
+        if any(review is None for review in reviews):
+            log.warning(f"Batched review of {file_name} failed, reviewing all {len(hunks)} hunks at once")
+            return await self.review_hunks(file_name, instructions, old_content, hunks)
+
+        # Map the hunks in each batch back to their position in the full list
+        return ReviewChanges(
+            hunks=[
+                Hunk(number=offset + hunk.number, reason=hunk.reason, decision=hunk.decision)
+                for offset, review in zip(offsets, reviews)
+                for hunk in review.hunks
+            ],
+            review_notes="\n\n".join(review.review_notes for review in reviews if review.review_notes),
+        )
+
+    async def review_hunks(
+        self, file_name: str, instructions: str, old_content: str, hunks: list[str]
+    ) -> Optional[ReviewChanges]:
+        """
+        Ask the LLM to review the diff hunks.
+
+        :param file_name: name of the file being modified
+        :param instructions: instructions for the reviewer
+        :param old_content: old file content
+        :param hunks: diff hunks to review
+        :return: review of all the hunks, or None if the reviewer failed to review them all
+        """
+        # The reviewer only needs to see the original code around the changes
+        old_content_context = self.get_old_content_context(old_content, hunks)
+
+        llm = self.get_llm(CODE_REVIEW_AGENT_NAME, cache_responses=True)
+        convo = (
+            self._get_task_convo()
+            .template(
+                "review_changes",
+                instructions=instructions,
+                file_name=file_name,
+                old_content=old_content_context,
+                old_content_is_partial=old_content_context != old_content,
+                hunks=hunks,
+            )
+            .require_schema(ReviewChanges)
+        )
+
+        llm_response: ReviewChanges = await llm(convo, temperature=0, parser=JSONParser(ReviewChanges))
+
+        for i in range(MAX_REVIEW_RETRIES):
+            decisions = {(hunk.number - 1, hunk.decision) for hunk in llm_response.hunks}
+            n_decisions = Counter(idx for idx, _ in decisions)
+            n_hunks = len(hunks)
+            missing_hunks = [str(idx + 1) for idx in range(n_hunks) if idx not in n_decisions]
+            unknown_hunks = [str(idx + 1) for idx in sorted(n_decisions) if not 0 <= idx < n_hunks]
+            conflicting_hunks = [str(idx + 1) for idx in sorted(n_decisions) if n_decisions[idx] > 1]
+            if not missing_hunks and not unknown_hunks and not conflicting_hunks:
+                return llm_response
+
+            # Point out all the problems at once, as there are only a few attempts to fix them
+            errors = []
+            if missing_hunks:
+                errors.append(
+                    f"Not all hunks have been reviewed, you didn't review hunks: {', '.join(missing_hunks)}. "
+                    "Please review all hunks and add 'apply', 'ignore' or 'rework' decision for each."
+                )
+            if unknown_hunks:
+                errors.append(
+                    f"Your review contains more hunks ({len(n_decisions)}) than in the original diff ({n_hunks}): "
+                    f"there are no hunks {', '.join(unknown_hunks)}. Note that one hunk may have multiple changed lines."
+                )
+            if conflicting_hunks:
+                errors.append(
+                    f"Your review contains conflicting decisions for hunks: {', '.join(conflicting_hunks)}. "
+                    "Please review each hunk only once, with a single 'apply', 'ignore' or 'rework' decision."
+                )
+            error = "\n\n".join(errors)
+
+            if i == MAX_REVIEW_RETRIES - 1:
+                return None
+
+            # The diff is already in the conversation, so we only point out what's wrong with the review
+            convo.assistant(llm_response.model_dump_json()).user(error)
+            llm_response = await llm(convo, temperature=0, parser=JSONParser(ReviewChanges))
+
     @staticmethod
     def get_line_changes(old_content: str, new_content: str) -> tuple[int, int]:
         """
@@ -346,51 +650,163 @@ class CodeMonkey(BaseAgent):
         :return: a tuple (added_lines, deleted_lines)
         """
 
-        from_lines = old_content.splitlines(keepends=True)
-        to_lines = new_content.splitlines(keepends=True)
-
-        diff_gen = unified_diff(from_lines, to_lines)
-
         added_lines = 0
         deleted_lines = 0
 
-        for line in diff_gen:
-            if line.startswith("+") and not line.startswith("+++"):  # Exclude the file headers
+        for line in _unified_diff(old_content, new_content):
+            if line.startswith("+"):
                 added_lines += 1
-            elif line.startswith("-") and not line.startswith("---"):  # Exclude the file headers
+            elif line.startswith("-"):
                 deleted_lines += 1
 
         return added_lines, deleted_lines
 
     @staticmethod
-    def get_diff_hunks(file_name: str, old_content: str, new_content: str) -> list[str]:
+    def get_diff_hunks(old_content: str, new_content: str) -> list[str]:
         """
         Get the diff between two files.
 
         This uses Python difflib to produce an unified diff, then splits
         it into hunks that will be separately reviewed by the reviewer.
 
-        :param file_name: name of the file being modified
         :param old_content: old file content
         :param new_content: new file content
         :return: change hunks from the unified diff
         """
-        from_name = "old_" + file_name
-        to_name = "to_" + file_name
-        from_lines = old_content.splitlines(keepends=True)
-        to_lines = new_content.splitlines(keepends=True)
-        diff_gen = unified_diff(from_lines, to_lines, fromfile=from_name, tofile=to_name)
-        diff_txt = "".join(diff_gen)
-
-        hunks = re.split(r"\n@@", diff_txt, re.MULTILINE)
+        hunks = []
+        for line in _unified_diff(old_content, new_content):
+            if line.startswith("@@"):
+                hunk = []
+                hunks.append(hunk)
+
+            if line.endswith("\n"):
+                hunk.append(line[:-1])
+            else:
+                # Last line of the file without the trailing newline
+                hunk.append(line)
+                hunk.append(NO_EOL)
+
+        return ["\n".join(hunk) for hunk in hunks]
+
+    @staticmethod
+    def get_old_content_context(old_content: str, hunks: list[str]) -> str:
+        """
+        Get the parts of the original file around the changes.
+
+        For each hunk, this takes the changed lines of the original file with
+        REVIEW_CONTEXT_LINES lines before and after. Overlapping parts are
+        merged, and the left out parts are replaced with a marker line.
+
+        :param old_content: old file content
+        :param hunks: change hunks from the unified diff
+        :return: parts of the old file content around the changes
+        """
+        lines = old_content.splitlines(keepends=True)
+
+        ranges = []
+        for hunk in hunks:
+            match = PATCH_HEADER_PATTERN.match(hunk)
+            start = int(match.group(1)) - 1
+            count = int(match.group(2)) if match.group(2) is not None else 1
+            begin = max(0, start - REVIEW_CONTEXT_LINES)
+            end = min(len(lines), start + count + REVIEW_CONTEXT_LINES)
+            if ranges and begin <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([begin, end])
+
+        parts = []
+        prev_end = 0
+        for begin, end in ranges:
+            if begin > prev_end:
+                parts.append(f"[... {begin - prev_end} unchanged lines not shown ...]\n")
+            parts.extend(lines[begin:end])
+            prev_end = end
+        if prev_end < len(lines):
+            parts.append(f"[... {len(lines) - prev_end} unchanged lines not shown ...]\n")
+
+        return "".join(parts)
+
+    @staticmethod
+    def locate_diff_hunks(content: str, diff: str) -> Optional[list[str]]:
+        """
+        Check the diff produced by the LLM and locate its hunks in the file.
+
+        LLMs are good at producing the changed lines with the surrounding
+        context, but not at counting lines, so the line numbers in the hunk
+        headers are only used as a hint. Each hunk is located by searching
+        the file for its unchanged and removed lines, and the hunk header
+        is rewritten with the actual position.
+
+        :param content: current file content
+        :param diff: unified diff produced by the LLM
+        :return: hunks with correct headers (empty if there are no changes),
+            or None if the diff is invalid or doesn't match the file
+        """
+        parsed_hunks = []
+        for line in diff.splitlines():
+            if not parsed_hunks and line.startswith(("---", "+++")):
+                # Skip the prologue (file names)
+                continue
+            if line.startswith("@@"):
+                match = PATCH_HEADER_PATTERN.match(line)
+                if not match:
+                    return None
+                parsed_hunks.append((int(match.group(1)), []))
+            elif not parsed_hunks:
+                return None
+            elif line == "":
+                # Trailing whitespace is commonly stripped from empty context lines
+                parsed_hunks[-1][1].append(" ")
+            elif line[0] in " -+":
+                parsed_hunks[-1][1].append(line)
+            elif line != NO_EOL:
+                return None
+
+        lines = content.splitlines()
+        stripped_lines = [line.rstrip() for line in lines]
+
         result = []
-        for i, h in enumerate(hunks):
-            # Skip the prologue (file names)
-            if i == 0:
+        start_index = 0
+        offset = 0
+        for hint, body in parsed_hunks:
+            old_lines = [line[1:].rstrip() for line in body if line[0] != "+"]
+            n_old = len(old_lines)
+            n_new = sum(1 for line in body if line[0] != "-")
+            if n_old == len(body) and n_new == len(body):
+                # No actual changes in this hunk
                 continue
-            txt = h.splitlines()
-            txt[0] = "@@" + txt[0]
-            result.append("\n".join(txt))
+
+            if old_lines:
+                positions = [
+                    i
+                    for i in range(start_index, len(lines) - n_old + 1)
+                    if stripped_lines[i] == old_lines[0] and stripped_lines[i : i + n_old] == old_lines
+                ]
+                if not positions:
+                    return None
+                # If the context is ambiguous, pick the location closest to the one LLM specified
+                position = min(positions, key=lambda i: abs(i - (hint - 1)))
+            else:
+                # Pure insertion without context, we can only trust the line number
+                position = min(max(hint, start_index), len(lines))
+
+            fixed_body = []
+            index = position
+            for line in body:
+                if line[0] == "+":
+                    fixed_body.append(line)
+                else:
+                    # Use the line from the file, in case the LLM changed whitespace
+                    fixed_body.append(line[0] + lines[index])
+                    index += 1
+
+            old_start = position + 1 if n_old else position
+            new_start = position + offset + 1 if n_new else position + offset
+            result.append("\n".join([f"@@ -{old_start},{n_old} +{new_start},{n_new} @@"] + fixed_body))
+            offset += n_new - n_old
+            start_index = position + n_old
+
         return result
 
     def apply_diff(self, file_name: str, old_content: str, hunks: list[str], fallback: str):
@@ -442,7 +858,7 @@ class CodeMonkey(BaseAgent):
         original_lines = original.splitlines(True)
         patch_lines = patch.splitlines(True)
 
-        updated_text = ""
+        updated_lines = []
         index_original = start_line = 0
 
         # Choose which group of the regex to use based on the revert flag
@@ -462,7 +878,7 @@ class CodeMonkey(BaseAgent):
             if start_line > line_number or line_number > len(original_lines):
                 raise Exception("Bad patch -- bad line number [line " + str(index_original) + "]")
 
-            updated_text += "".join(original_lines[start_line:line_number])
+            updated_lines.extend(original_lines[start_line:line_number])
             start_line = line_number
             index_original += 1
 
@@ -476,8 +892,8 @@ class CodeMonkey(BaseAgent):
 
                 if line_content:
                     if line_content[0] == line_sign or line_content[0] == " ":
-                        updated_text += line_content[1:]
+                        updated_lines.append(line_content[1:])
                     start_line += line_content[0] != line_sign
 
-        updated_text += "".join(original_lines[start_line:])
-        return updated_text
+        updated_lines.extend(original_lines[start_line:])
+        return "".join(updated_lines)
@@ -2,6 +2,7 @@ import json
 import sys
 from copy import deepcopy
 from typing import TYPE_CHECKING, Optional
+from uuid import UUID
 
 import jsonref
 from pydantic import BaseModel
@@ -20,6 +21,10 @@ log = get_logger(__name__)
 class AgentConvo(Convo):
     prompt_loader: Optional[JinjaFileTemplate] = None
 
+    # Prompts rendered for the current project state, see `system_template()`
+    render_cache: dict[tuple[str, str], str] = {}
+    render_cache_state_id: Optional[UUID] = None
+
     def __init__(self, agent: "BaseAgent"):
         self.agent_instance = agent
 
@@ -74,13 +79,61 @@ class AgentConvo(Convo):
     def template(self, template_name: str, **kwargs) -> "AgentConvo":
         message = self.render(template_name, **kwargs)
         self.user(message)
+        self._log_template(template_name, kwargs)
+        return self
+
+    def render_cached(self, name: str, **kwargs) -> str:
+        """
+        Render a template, reusing the result for the same project state.
+
+        The project state (including all the project files) doesn't change
+        while agents are working on it, so rendering the template with the
+        same arguments gives the same result. This avoids rendering large
+        templates (eg. with all the project files) for every file changed
+        in the same step.
+
+        The template arguments are part of the cache key, so they must be
+        plain JSON values (strings, numbers, lists, dicts); other objects
+        raise a TypeError.
+        """
+        state_id = self.agent_instance.current_state.id
+        if state_id is None:
+            return self.render(name, **kwargs)
+
+        if state_id != AgentConvo.render_cache_state_id:
+            AgentConvo.render_cache.clear()
+            AgentConvo.render_cache_state_id = state_id
+
+        key = (
+            f"{self.agent_instance.agent_type}/{name}",
+            json.dumps(kwargs, sort_keys=True),
+        )
+        if key not in AgentConvo.render_cache:
+            AgentConvo.render_cache[key] = self.render(name, **kwargs)
+        return AgentConvo.render_cache[key]
+
+    def system_template(self, template_name: str, **kwargs) -> "AgentConvo":
+        """
+        Render a template and add it to the conversation as a system message.
+
+        Use this for large parts of the prompt that don't change between
+        requests (eg. coding rules and project files), so they form a stable
+        prefix that the LLM provider can cache. The rendered template is
+        reused for the same project state (see `render_cached()`), so only
+        plain JSON values may be passed as template arguments.
+        """
+        message = self.render_cached(template_name, **kwargs)
+        self.system(message)
+        self._log_template(template_name, kwargs)
+        return self
+
+    def _log_template(self, template_name: str, context: dict):
         self.prompt_log.append(
             {
                 "template": f"{self.agent_instance.agent_type}/{template_name}",
-                "context": self._serialize_prompt_context(kwargs),
+                "context": self._serialize_prompt_context(context),
             }
         )
-        return self
 
     def fork(self) -> "AgentConvo":
         child = AgentConvo(self.agent_instance)
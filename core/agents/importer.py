@@ -46,7 +46,7 @@ class Importer(BaseAgent):
         )
 
         imported_files, _ = await self.state_manager.import_files()
-        imported_lines = sum(len(f.content.content.splitlines()) for f in imported_files)
+        imported_lines = sum(f.content.line_count for f in imported_files)
         if imported_lines > MAX_PROJECT_LINES:
             await self.send_message(
                 "WARNING: Your project ({imported_lines} LOC) is larger than supported and may cause issues in Pythagora."
@@ -86,7 +86,7 @@ class Importer(BaseAgent):
             }
         ]
 
-        n_lines = sum(len(f.content.content.splitlines()) for f in self.current_state.files)
+        n_lines = sum(f.content.line_count for f in self.current_state.files)
         await telemetry.trace_code_event(
             "existing-project",
             {
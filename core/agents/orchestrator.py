@@ -26,6 +26,10 @@ from core.ui.base import ProjectStage
 
 log = get_logger(__name__)
 
+# Maximum number of agents running in parallel. Each agent usually makes one LLM request at a time,
+# except for code review of large diffs (see code_monkey.MAX_PARALLEL_REVIEW_BATCHES).
+MAX_PARALLEL_AGENTS = 5
+
 
 class Orchestrator(BaseAgent):
     """
@@ -67,11 +71,10 @@ class Orchestrator(BaseAgent):
             # In case where agent is a list, run all agents in parallel.
             # Only one agent type can be run in parallel at a time (for now). See handle_parallel_responses().
             if isinstance(agent, list):
-                tasks = [single_agent.run() for single_agent in agent]
                 log.debug(
                     f"Running agents {[a.__class__.__name__ for a in agent]} (step {self.current_state.step_index})"
                 )
-                responses = await asyncio.gather(*tasks)
+                responses = await self.run_parallel_agents(agent)
                 response = self.handle_parallel_responses(agent[0], responses)
             else:
                 log.debug(f"Running agent {agent.__class__.__name__} (step {self.current_state.step_index})")
@@ -88,6 +91,25 @@ class Orchestrator(BaseAgent):
         # TODO: rollback changes to "next" so they aren't accidentally committed?
         return True
 
+    @staticmethod
+    async def run_parallel_agents(agents: List[BaseAgent]) -> List[AgentResponse]:
+        """
+        Run multiple agents in parallel.
+
+        At most MAX_PARALLEL_AGENTS agents run at the same time, to avoid
+        flooding the LLM provider with requests and hitting rate limits.
+
+        :param agents: Agents to run.
+        :return: List of responses, in the same order as the agents.
+        """
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_AGENTS)
+
+        async def run_agent(agent: BaseAgent) -> AgentResponse:
+            async with semaphore:
+                return await agent.run()
+
+        return await asyncio.gather(*[run_agent(agent) for agent in agents])
+
     def handle_parallel_responses(self, agent: BaseAgent, responses: List[AgentResponse]) -> AgentResponse:
         """
         Handle responses from agents that were run in parallel.
@@ -294,11 +316,9 @@ class Orchestrator(BaseAgent):
     def create_agent_for_step(self, step: dict) -> Union[List[BaseAgent], BaseAgent]:
         step_type = step.get("type")
         if step_type == "save_file":
-            steps = self.current_state.get_steps_of_type("save_file")
-            parallel = []
-            for step in steps:
-                parallel.append(CodeMonkey(self.state_manager, self.ui, step=step))
-            return parallel
+            return [
+                CodeMonkey(self.state_manager, self.ui, step=step) for step in self.get_independent_save_file_steps()
+            ]
         elif step_type == "command":
             return self.executor.for_step(step)
         elif step_type == "human_intervention":
@@ -310,6 +330,32 @@ class Orchestrator(BaseAgent):
         else:
             raise ValueError(f"Unknown step type: {step_type}")
 
+    def get_independent_save_file_steps(self) -> list[dict]:
+        """
+        Get the "save_file" steps that can be implemented in parallel.
+
+        These are the consecutive "save_file" steps at the start of the unfinished
+        steps list, up to the first step that changes an already included file (the
+        changes to the same file must be done one after another) or a step of a
+        different type.
+
+        As each agent completes the first unfinished step, the returned steps must
+        be at the beginning of the unfinished steps list.
+
+        :return: List of steps to implement in parallel.
+        """
+        steps = []
+        paths = set()
+        for step in self.current_state.unfinished_steps:
+            if step.get("type") != "save_file":
+                break
+            path = step["save_file"]["path"]
+            if path in paths:
+                break
+            paths.add(path)
+            steps.append(step)
+        return steps
+
     async def import_files(self) -> Optional[AgentResponse]:
         imported_files, removed_paths = await self.state_manager.import_files()
         if not imported_files and not removed_paths:
@@ -368,7 +414,7 @@ class Orchestrator(BaseAgent):
         total_lines = 0
         for file in self.current_state.files:
             total_files += 1
-            total_lines += len(file.content.content.splitlines())
+            total_lines += file.content.line_count
 
         telemetry.set("num_files", total_files)
         telemetry.set("num_lines", total_lines)
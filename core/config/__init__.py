@@ -36,6 +36,8 @@ IGNORE_SIZE_THRESHOLD = 50000  # 50K+ files are ignored by default
 DEFAULT_AGENT_NAME = "default"
 CODE_MONKEY_AGENT_NAME = "CodeMonkey"
 CODE_REVIEW_AGENT_NAME = "CodeMonkey.code_review"
+# Optional, only used if explicitly configured
+CODE_REVIEW_PRECHECK_AGENT_NAME = "CodeMonkey.code_review_precheck"
 DESCRIBE_FILES_AGENT_NAME = "CodeMonkey.describe_files"
 CHECK_LOGS_AGENT_NAME = "BugHunter.check_logs"
 PARSE_TASK_AGENT_NAME = "Developer.parse_task"
@@ -22,6 +22,27 @@ class FileContent(Base):
     # Relationships
     files: Mapped[list["File"]] = relationship(back_populates="content", lazy="raise")
 
+    @property
+    def line_count(self) -> int:
+        """
+        Number of lines in the file content.
+        """
+        return self.count_lines(self.content)
+
+    @staticmethod
+    def count_lines(content: str) -> int:
+        """
+        Count the number of `\n`-terminated lines (plus an unterminated last line).
+
+        This avoids building the list of lines just to count them. Unlike
+        `str.splitlines()`, other line boundaries (eg. `\r`, form feed or
+        U+2028) are not counted as line breaks.
+
+        :param content: The text to count lines in.
+        :return: Number of lines.
+        """
+        return content.count("\n") + (1 if content and not content.endswith("\n") else 0)
+
     @classmethod
     async def store(cls, session: AsyncSession, hash: str, content: str) -> "FileContent":
         """
@@ -1,6 +1,6 @@
 import datetime
 import zoneinfo
-from typing import Optional
+from typing import Callable, Optional
 
 from anthropic import AsyncAnthropic, RateLimitError
 from httpx import Timeout
@@ -17,6 +17,9 @@ log = get_logger(__name__)
 MAX_TOKENS = 4096
 MAX_TOKENS_SONNET = 8192
 
+# Beta feature flag for Anthropic prompt caching
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+
 
 class AnthropicClient(BaseLLMClient):
     provider = LLMProvider.ANTHROPIC
@@ -33,21 +36,30 @@ class AnthropicClient(BaseLLMClient):
         )
         self.stream_handler = self.stream_handler
 
-    def _adapt_messages(self, convo: Convo) -> list[dict[str, str]]:
+    def _adapt_messages(self, convo: Convo) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
         """
         Adapt the conversation messages to the format expected by the Anthropic Claude model.
 
         Claude only recognizes "user" and "assistant" roles, and requires them to be switched
         for each message (ie. no consecutive messages from the same role).
 
+        System messages at the start of the conversation are returned separately as system
+        prompt blocks, so they can be marked for prompt caching. System messages that appear
+        later in the conversation are treated as user messages.
+
         :param convo: Conversation to adapt.
-        :return: Adapted conversation messages.
+        :return: Tuple of system prompt blocks and adapted conversation messages.
         """
+        system = []
         messages = []
         for msg in convo.messages:
             if msg["role"] == "function":
                 raise ValueError("Anthropic Claude doesn't support function calling")
 
+            if msg["role"] == "system" and not messages:
+                system.append({"type": "text", "text": msg["content"]})
+                continue
+
             role = "user" if msg["role"] in ["user", "system"] else "assistant"
             if messages and messages[-1]["role"] == role:
                 messages[-1]["content"] += "\n\n" + msg["content"]
@@ -58,45 +70,70 @@ class AnthropicClient(BaseLLMClient):
                         "content": msg["content"],
                     }
                 )
-        return messages
+
+        if not messages and system:
+            # Claude requires at least one user message, so we can't send only the system prompt
+            messages.append({"role": "user", "content": "\n\n".join(block["text"] for block in system)})
+            system = []
+
+        return system, messages
 
     async def _make_request(
         self,
         convo: Convo,
         temperature: Optional[float] = None,
         json_mode: bool = False,
+        stream_check: Optional[Callable] = None,
     ) -> tuple[str, int, int]:
-        messages = self._adapt_messages(convo)
+        system, messages = self._adapt_messages(convo)
         completion_kwargs = {
             "max_tokens": MAX_TOKENS,
             "model": self.config.model,
             "messages": messages,
             "temperature": self.config.temperature if temperature is None else temperature,
         }
+        betas = []
 
-        if "bedrock/anthropic" in self.config.base_url:
+        if "bedrock/anthropic" in (self.config.base_url or ""):
             completion_kwargs["extra_headers"] = {"anthropic-version": "bedrock-2023-05-31"}
+        elif system:
+            # Cache everything up to and including the system prompt, so that requests
+            # sharing the same (large) prefix don't have to process it again.
+            system[-1]["cache_control"] = {"type": "ephemeral"}
+            betas.append(PROMPT_CACHING_BETA)
+
+        if system:
+            completion_kwargs["system"] = system
 
         if "sonnet" in self.config.model:
-            if "extra_headers" in completion_kwargs:
-                completion_kwargs["extra_headers"]["anthropic-beta"] = "max-tokens-3-5-sonnet-2024-07-15"
-            else:
-                completion_kwargs["extra_headers"] = {"anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"}
+            betas.append("max-tokens-3-5-sonnet-2024-07-15")
             completion_kwargs["max_tokens"] = MAX_TOKENS_SONNET
 
+        if betas:
+            completion_kwargs.setdefault("extra_headers", {})["anthropic-beta"] = ",".join(betas)
+
         if json_mode:
             completion_kwargs["response_format"] = {"type": "json_object"}
 
         response = []
+        stopped_early = False
         async with self.client.messages.stream(**completion_kwargs) as stream:
             async for content in stream.text_stream:
                 response.append(content)
                 if self.stream_handler:
                     await self.stream_handler(content)
 
-            # TODO: get tokens from the final message
-            final_message = await stream.get_final_message()
-            final_message.content
+                if stream_check and not stream_check(content):
+                    log.debug("Response doesn't look as expected, stopping the LLM response stream")
+                    stopped_early = True
+                    break
+
+            if stopped_early:
+                # We stopped the stream early, so there's no final message; output
+                # token count is only updated at the end, so it's underestimated here.
+                final_message = stream.current_message_snapshot
+            else:
+                final_message = await stream.get_final_message()
 
         response_str = "".join(response)
 
@@ -104,7 +141,14 @@ class AnthropicClient(BaseLLMClient):
         if self.stream_handler:
             await self.stream_handler(None)
 
-        return response_str, final_message.usage.input_tokens, final_message.usage.output_tokens
+        usage = final_message.usage
+        # With prompt caching, cached (and newly cached) tokens are not included in `input_tokens`
+        input_tokens = (
+            usage.input_tokens
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        )
+        return response_str, input_tokens, usage.output_tokens
 
     def rate_limit_sleep(self, err: RateLimitError) -> Optional[datetime.timedelta]:
         """
@@ -8,6 +8,7 @@ from typing import Any, Callable, Optional, Tuple
 import httpx
 
 from core.config import LLMConfig, LLMProvider
+from core.llm.cache import ResponseCache
 from core.llm.convo import Convo
 from core.llm.request_log import LLMRequestLog, LLMRequestStatus
 from core.log import get_logger
@@ -51,16 +52,19 @@ class BaseLLMClient:
         *,
         stream_handler: Optional[Callable] = None,
         error_handler: Optional[Callable] = None,
+        response_cache: Optional[ResponseCache] = None,
     ):
         """
         Initialize the client with the given configuration.
 
         :param config: Configuration for the client.
         :param stream_handler: Optional handler for streamed responses.
+        :param response_cache: Optional cache for reusing responses to identical requests.
         """
         self.config = config
         self.stream_handler = stream_handler
         self.error_handler = error_handler
+        self.response_cache = response_cache
         self._init_client()
 
     def _init_client(self):
@@ -71,6 +75,7 @@ class BaseLLMClient:
         convo: Convo,
         temperature: Optional[float] = None,
         json_mode: bool = False,
+        stream_check: Optional[Callable] = None,
     ) -> tuple[str, int, int]:
         """
         Call the Anthropic Claude model with the given conversation.
@@ -80,6 +85,7 @@ class BaseLLMClient:
 
         :param convo: Conversation to send to the LLM.
         :param json_mode: If True, the response is expected to be JSON.
+        :param stream_check: Optional check for the response chunks; stop streaming if it returns False.
         :return: Tuple containing the full response content, number of input tokens, and number of output tokens.
         """
         raise NotImplementedError()
@@ -118,6 +124,7 @@ class BaseLLMClient:
         parser: Optional[Callable] = None,
         max_retries: int = 3,
         json_mode: bool = False,
+        stream_check: Optional[Callable] = None,
     ) -> Tuple[Any, LLMRequestLog]:
         """
         Invoke the LLM with the given conversation.
@@ -132,10 +139,18 @@ class BaseLLMClient:
         a descriptive error message that will be sent back to the LLM
         to retry, up to max_retries.
 
+        Stream check, if provided, should be a function that takes
+        a single argument, the response chunk (str), and returns
+        whether the response looks as expected so far. If it returns
+        False, the LLM generation is stopped and the partial response
+        is used (and passed to the parser, if any). Use this to avoid
+        waiting (and paying) for a response that will be thrown away.
+
         :param convo: Conversation to send to the LLM.
         :param parser: Optional parser for the response.
         :param max_retries: Maximum number of retries for parsing the response.
         :param json_mode: If True, the response is expected to be JSON.
+        :param stream_check: Optional check for the response chunks.
         :return: Tuple of the (parsed) response and request log entry.
         """
         import anthropic
@@ -153,6 +168,13 @@ class BaseLLMClient:
             prompts=convo.prompt_log,
         )
 
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(self.provider.value, self.config.model, temperature, json_mode, convo)
+            cached = self._get_cached_response(cache_key, convo, request_log, parser)
+            if cached is not None:
+                return cached, request_log
+
         prompt_length_kb = len(json.dumps(convo.messages).encode("utf-8")) / 1024
         log.debug(
             f"Calling {self.provider.value} model {self.config.model} (temp={temperature}), prompt length: {prompt_length_kb:.1f} KB"
@@ -190,6 +212,7 @@ class BaseLLMClient:
                     convo,
                     temperature=temperature,
                     json_mode=json_mode,
+                    stream_check=stream_check,
                 )
             except (openai.APIConnectionError, anthropic.APIConnectionError, groq.APIConnectionError) as err:
                 log.warning(f"API connection error: {err}", exc_info=True)
@@ -300,6 +323,9 @@ class BaseLLMClient:
             else:
                 break
 
+        if cache_key is not None:
+            self.response_cache.set(cache_key, request_log.response)
+
         t1 = time()
         request_log.duration = t1 - t0
 
@@ -309,6 +335,45 @@ class BaseLLMClient:
 
         return response, request_log
 
+    def _get_cached_response(
+        self,
+        cache_key: str,
+        convo: Convo,
+        request_log: LLMRequestLog,
+        parser: Optional[Callable],
+    ) -> Optional[Any]:
+        """
+        Look up the response to an identical earlier request.
+
+        The cached raw response goes through the parser again, so the
+        caller gets a fresh parsed object. If there's nothing cached,
+        or the cached response can't be parsed, None is returned and
+        the request should be sent to the LLM.
+
+        :param cache_key: Request key (see `ResponseCache.key()`).
+        :param convo: Conversation to send to the LLM.
+        :param request_log: Request log to fill in on cache hit.
+        :param parser: Optional parser for the response.
+        :return: The (parsed) cached response, or None.
+        """
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            return None
+
+        if parser:
+            try:
+                parsed = parser(response)
+            except ValueError as err:
+                log.debug(f"Error parsing cached LLM response: {err}, ignoring cache", exc_info=True)
+                return None
+        else:
+            parsed = response
+
+        log.debug(f"Using cached {self.provider.value} model {self.config.model} response")
+        request_log.messages = convo.messages[:]
+        request_log.response = response
+        return parsed
+
     async def api_check(self) -> bool:
         """
         Perform an LLM API check.
@@ -0,0 +1,87 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from core.llm.convo import Convo
+
+# Maximum number of responses kept in the cache
+MAX_CACHED_RESPONSES = 256
+
+
+class ResponseCache:
+    """
+    In-memory cache of raw LLM responses.
+
+    Responses are keyed on the hash of everything that determines the
+    LLM output: provider, model, temperature, JSON mode and the full
+    conversation. As file contents are part of the conversation, any
+    change to a file automatically results in a different key.
+
+    Only use this for deterministic (zero temperature) requests, where
+    asking the same question again is expected to give the same answer.
+    """
+
+    def __init__(self, max_size: int = MAX_CACHED_RESPONSES):
+        self.max_size = max_size
+        self._responses: OrderedDict[str, str] = OrderedDict()
+
+    @staticmethod
+    def key(provider: str, model: str, temperature: float, json_mode: bool, convo: Convo) -> str:
+        """
+        Compute the cache key for a request.
+
+        :param provider: LLM provider.
+        :param model: Model name.
+        :param temperature: Sampling temperature.
+        :param json_mode: Whether the response is expected to be JSON.
+        :param convo: Conversation to send to the LLM.
+        :return: Hex digest identifying the request.
+        """
+        payload = json.dumps(
+            {
+                "provider": provider,
+                "model": model,
+                "temperature": temperature,
+                "json_mode": json_mode,
+                "messages": convo.messages,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the cached response for the request, if any.
+
+        :param key: Request key (see `ResponseCache.key()`).
+        :return: Raw LLM response, or None if it's not cached.
+        """
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+        return response
+
+    def set(self, key: str, response: str):
+        """
+        Store the response, evicting the least recently used one if the cache is full.
+
+        :param key: Request key (see `ResponseCache.key()`).
+        :param response: Raw LLM response.
+        """
+        self._responses[key] = response
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_size:
+            self._responses.popitem(last=False)
+
+    def clear(self):
+        self._responses.clear()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+response_cache = ResponseCache()
+
+
+__all__ = ["ResponseCache", "response_cache"]
@@ -1,5 +1,5 @@
 import datetime
-from typing import Optional
+from typing import Callable, Optional
 
 import tiktoken
 from groq import AsyncGroq, RateLimitError
@@ -33,6 +33,7 @@ class GroqClient(BaseLLMClient):
         convo: Convo,
         temperature: Optional[float] = None,
         json_mode: bool = False,
+        stream_check: Optional[Callable] = None,
     ) -> tuple[str, int, int]:
         completion_kwargs = {
             "model": self.config.model,
@@ -60,6 +61,11 @@ class GroqClient(BaseLLMClient):
             if self.stream_handler:
                 await self.stream_handler(content)
 
+            if stream_check and not stream_check(content):
+                log.debug("Response doesn't look as expected, stopping the LLM response stream")
+                await stream.close()
+                break
+
         response_str = "".join(response)
 
         # Tell the stream handler we're done
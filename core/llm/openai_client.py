@@ -1,6 +1,6 @@
 import datetime
 import re
-from typing import Optional
+from typing import Callable, Optional
 
 import tiktoken
 from httpx import Timeout
@@ -35,6 +35,7 @@ class OpenAIClient(BaseLLMClient):
         convo: Convo,
         temperature: Optional[float] = None,
         json_mode: bool = False,
+        stream_check: Optional[Callable] = None,
     ) -> tuple[str, int, int]:
         completion_kwargs = {
             "model": self.config.model,
@@ -69,6 +70,11 @@ class OpenAIClient(BaseLLMClient):
             if self.stream_handler:
                 await self.stream_handler(content)
 
+            if stream_check and not stream_check(content):
+                log.debug("Response doesn't look as expected, stopping the LLM response stream")
+                await stream.close()
+                break
+
         response_str = "".join(response)
 
         # Tell the stream handler we're done
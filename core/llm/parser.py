@@ -70,12 +70,16 @@ class CodeBlockParser(MultiCodeBlockParser):
 
 
 class OptionalCodeBlockParser:
+    # Matches the whole text wrapped in a code block. Note the first line may include
+    # syntax highlighting, so we can't just remove the first 3 characters.
+    pattern = re.compile(r"\A```[^\n]*\n(?:(.*)\n)?```\Z", re.DOTALL)
+
     def __call__(self, text: str) -> str:
         text = text.strip()
-        if text.startswith("```") and text.endswith("\n```"):
-            # Remove the first and last line. Note the first line may include syntax
-            # highlighting, so we can't just remove the first 3 characters.
-            text = "\n".join(text.splitlines()[1:-1]).strip()
+        match = self.pattern.match(text)
+        if match:
+            # Remove the first and last line
+            text = (match.group(1) or "").strip()
         elif "\n" not in text and text.startswith("`") and text.endswith("`"):
             # Single-line code blocks are wrapped in single backticks
             text = text[1:-1]
@@ -4,6 +4,16 @@ from typing import Any, Optional
 from jinja2 import BaseLoader, Environment, FileSystemLoader, StrictUndefined, TemplateNotFound
 
 
+def render_file(file: Any) -> str:
+    """
+    Render the file path and contents as a Markdown code block.
+
+    :param file: File object (with `path`, `content.content` and `content.line_count` attributes).
+    :return: Rendered file block.
+    """
+    return f"**`{file.path}`** ({file.content.line_count} lines of code):\n```\n{file.content.content}```\n"
+
+
 class FormatTemplate:
     def __call__(self, template: str, **kwargs: dict[str, Any]) -> str:
         return template.format(**kwargs)
@@ -19,6 +29,7 @@ class BaseJinjaTemplate:
             keep_trailing_newline=True,
             undefined=StrictUndefined,
         )
+        self.env.filters["render_file"] = render_file
 
 
 class JinjaStringTemplate(BaseJinjaTemplate):
@@ -399,7 +399,7 @@ class StateManager:
             file.meta = metadata
 
         if not from_template:
-            delta_lines = len(content.splitlines()) - len(original_content.splitlines())
+            delta_lines = FileContent.count_lines(content) - FileContent.count_lines(original_content)
             telemetry.inc("created_lines", delta_lines)
 
     async def init_file_system(self, load_existing: bool) -> VirtualFileSystem:
@@ -481,12 +481,13 @@ class StateManager:
             file = self.next_state.save_file(path, file_content, external=True)
             imported_files.append(file)
 
-        for path, file in known_files.items():
-            if path not in files_in_workspace:
+        removed_paths = [path for path in known_files if path not in files_in_workspace]
+        if removed_paths:
+            next_state_files = {file.path: file for file in self.next_state.files}
+            for path in removed_paths:
                 log.debug(f"File {path} was removed from workspace, deleting from project")
-                next_state_file = self.next_state.get_file_by_path(path)
-                self.next_state.files.remove(next_state_file)
-                removed_files.append(file.path)
+                self.next_state.files.remove(next_state_files[path])
+                removed_files.append(path)
 
         return imported_files, removed_files
 
@@ -519,20 +520,23 @@ class StateManager:
         :return: List of paths for new or modified files.
         """
 
+        await self.current_state.awaitable_attrs.files
+        known_files = {file.path: file for file in self.current_state.files}
+
         modified_files = []
-        files_in_workspace = self.file_system.list()
-        for path in files_in_workspace:
+        files_in_workspace = set()
+        for path in self.file_system.list():
+            files_in_workspace.add(path)
             content = self.file_system.read(path)
-            saved_file = self.current_state.get_file_by_path(path)
+            saved_file = known_files.get(path)
             if saved_file and saved_file.content.content == content:
                 continue
             modified_files.append(path)
 
         # Handle files removed from disk
-        await self.current_state.awaitable_attrs.files
-        for db_file in self.current_state.files:
-            if db_file.path not in files_in_workspace:
-                modified_files.append(db_file.path)
+        for path in known_files:
+            if path not in files_in_workspace:
+                modified_files.append(path)
 
         return modified_files
 
@@ -545,12 +549,16 @@ class StateManager:
                 and new content for new or modified files.
         """
 
+        await self.current_state.awaitable_attrs.files
+        known_files = {file.path: file for file in self.current_state.files}
+
         modified_files = []
-        files_in_workspace = self.file_system.list()
+        files_in_workspace = set()
 
-        for path in files_in_workspace:
+        for path in self.file_system.list():
+            files_in_workspace.add(path)
             content = self.file_system.read(path)
-            saved_file = self.current_state.get_file_by_path(path)
+            saved_file = known_files.get(path)
 
             # If there's a saved file, serialize its content; otherwise, set it to None
             saved_file_content = saved_file.content.content if saved_file else None
@@ -567,12 +575,11 @@ class StateManager:
             )
 
         # Handle files removed from disk
-        await self.current_state.awaitable_attrs.files
-        for db_file in self.current_state.files:
-            if db_file.path not in files_in_workspace:
+        for path, db_file in known_files.items():
+            if path not in files_in_workspace:
                 modified_files.append(
                     {
-                        "path": db_file.path,
+                        "path": path,
                         "file_old": db_file.content.content,  # Serialized content
                         "file_new": "",  # Empty string as the file is removed
                     }
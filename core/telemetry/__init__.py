@@ -128,6 +128,8 @@ class Telemetry:
                 "num_commands": 0,
                 # Number of times a human input was required during development
                 "num_inputs": 0,
+                # Number of code reviews skipped because the change was trivial
+                "num_skipped_reviews": 0,
                 # Number of files in the project
                 "num_files": 0,
                 # Total number of lines in the project
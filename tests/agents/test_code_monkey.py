@@ -0,0 +1,414 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from core.agents.code_monkey import (
+    MAX_PARALLEL_REVIEW_BATCHES,
+    CodeMonkey,
+    DiffStreamCheck,
+    Hunk,
+    HunkPrecheck,
+    PrecheckChanges,
+    ReviewChanges,
+    _unified_diff,
+)
+from core.config import CODE_REVIEW_PRECHECK_AGENT_NAME, AgentLLMConfig, LLMProvider
+from core.llm.base import APIError, BaseLLMClient
+
+ORIGINAL = "def foo():\n    return 1\n\n\ndef bar():\n    return 2\n\n\ndef baz():\n    return 3\n"
+
+
+def test_locate_diff_hunks_fixes_line_numbers():
+    diff = "\n".join(
+        [
+            "@@ -1,2 +1,2 @@",
+            " def bar():",
+            "-    return 2",
+            "+    return 20",
+            "",
+            "@@ -7,2 +7,3 @@",
+            " def baz():",
+            "+    print('baz')",
+            "     return 3",
+        ]
+    )
+
+    hunks = CodeMonkey.locate_diff_hunks(ORIGINAL, diff)
+    assert hunks == [
+        "@@ -5,3 +5,3 @@\n def bar():\n-    return 2\n+    return 20\n ",
+        "@@ -9,2 +9,3 @@\n def baz():\n+    print('baz')\n     return 3",
+    ]
+
+    new_content = CodeMonkey._apply_patch(ORIGINAL, "\n".join(hunks) + "\n")
+    assert new_content == (
+        "def foo():\n    return 1\n\n\ndef bar():\n    return 20\n\n\ndef baz():\n    print('baz')\n    return 3\n"
+    )
+
+
+def test_locate_diff_hunks_no_changes():
+    assert CodeMonkey.locate_diff_hunks(ORIGINAL, "") == []
+    assert CodeMonkey.locate_diff_hunks(ORIGINAL, "@@ -1,1 +1,1 @@\n def foo():") == []
+
+
+@pytest.mark.parametrize(
+    "diff",
+    [
+        "here are the changes",
+        "@@ invalid header @@\n def foo():\n+    pass",
+        "@@ -1,2 +1,2 @@\n def foo():\n-    return 100\n+    return 2",
+        "@@ -5,2 +5,2 @@\n def bar():\n-    return 2\n+    return 20\n@@ -1,2 +1,2 @@\n def foo():\n-    return 1\n+    return 10",
+    ],
+)
+def test_locate_diff_hunks_invalid(diff):
+    assert CodeMonkey.locate_diff_hunks(ORIGINAL, diff) is None
+
+
+@pytest.mark.parametrize(
+    ("chunks", "expected"),
+    [
+        (["```diff\n@@ -1,2", " +1,2 @@\n", " def foo():\n"], [True, True, True]),
+        (["@@ -1,2 +1,2 @@", "\n def foo():\n"], [True, True]),
+        (["```diff\n", "\n", "@@ -1,2 +1,2 @@\n", " def foo():\n"], [True, True, True, True]),
+        (["```diff\n\n", "\ndef foo", "():\n"], [True, True, False]),
+        (["```", "python\n", "def foo", "():\n", "    return 1\n"], [True, True, True, False, True]),
+        (["Here are", " the changes:\n"], [True, False]),
+    ],
+)
+def test_diff_stream_check(chunks, expected):
+    check = DiffStreamCheck()
+    assert [check(chunk) for chunk in chunks] == expected
+
+
+@pytest.mark.asyncio
+async def test_implement_changes_as_diff():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    convo = MagicMock()
+    llm = AsyncMock(return_value="@@ -1,2 +1,2 @@\n def foo():\n-    return 1\n+    return 10\n")
+
+    new_content = await cm.implement_changes_as_diff(llm, convo, "foo.py", ORIGINAL)
+    assert new_content == ORIGINAL.replace("return 1\n", "return 10\n")
+    convo.template.assert_called_once_with("implement_changes_diff", file_name="foo.py", file_content=ORIGINAL)
+
+    llm.return_value = "def foo():\n    return 10\n"
+    assert await cm.implement_changes_as_diff(llm, convo, "foo.py", ORIGINAL) is None
+
+
+def test_get_diff_hunks():
+    old_content = "".join(f"line {i}\n" for i in range(100))
+    new_content = old_content.replace("line 5\n", "line 5 changed\n").replace("line 95\n", "")
+
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+    assert hunks == [
+        "@@ -3,7 +3,7 @@\n line 2\n line 3\n line 4\n-line 5\n+line 5 changed\n line 6\n line 7\n line 8",
+        "@@ -93,7 +93,6 @@\n line 92\n line 93\n line 94\n-line 95\n line 96\n line 97\n line 98",
+    ]
+
+
+def test_get_diff_hunks_many_hunks():
+    old_content = "".join(f"line {i}\n" for i in range(200))
+    new_content = "".join(f"line {i}\n" if i % 10 else f"changed {i}\n" for i in range(200))
+
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+    assert len(hunks) == 20
+    assert all(hunk.startswith("@@ ") for hunk in hunks)
+
+
+def test_get_line_changes_reuses_diff():
+    old_content = "".join(f"line {i}\n" for i in range(100))
+    new_content = old_content.replace("line 5\n", "++line 5\n").replace("line 95\n", "")
+
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+    hits = _unified_diff.cache_info().hits
+    assert CodeMonkey.get_line_changes(old_content, new_content) == (1, 2)
+    assert _unified_diff.cache_info().hits == hits + 1
+    assert len(hunks) == 2
+
+
+def test_get_diff_hunks_no_newline_at_end():
+    old_content = "a\nb"
+    new_content = "a\nc"
+
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+    assert hunks == [
+        "@@ -1,2 +1,2 @@\n a\n-b\n\\ No newline at end of file\n+c\n\\ No newline at end of file",
+    ]
+    assert CodeMonkey._apply_patch(old_content, "\n".join(hunks) + "\n") == new_content
+
+
+@pytest.mark.asyncio
+async def test_review_change_skips_trivial_changes():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm.get_llm = MagicMock()
+
+    new_content = ORIGINAL.replace("return 2", "return 20")
+    assert await cm.review_change("foo.py", "instructions", ORIGINAL, new_content) == (new_content, None)
+    cm.get_llm.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_review_change_asks_for_missing_hunks():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm._get_task_convo = MagicMock()
+    convo = cm._get_task_convo.return_value.template.return_value.require_schema.return_value
+    convo.assistant.return_value = convo
+    cm.get_llm = MagicMock(
+        return_value=AsyncMock(
+            side_effect=[
+                ReviewChanges(
+                    hunks=[Hunk(number=1, reason="ok", decision="apply")],
+                    review_notes="",
+                ),
+                ReviewChanges(
+                    hunks=[
+                        Hunk(number=1, reason="ok", decision="apply"),
+                        Hunk(number=2, reason="wrong", decision="ignore"),
+                    ],
+                    review_notes="",
+                ),
+            ]
+        )
+    )
+
+    new_content = ORIGINAL.replace("return 1", "return 10").replace("return 3", "return 30")
+    approved_content, feedback = await cm.review_change("foo.py", "instructions", ORIGINAL, new_content)
+
+    assert approved_content == ORIGINAL.replace("return 1", "return 10")
+    assert feedback is None
+    assert "you didn't review hunks: 2." in convo.user.call_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_review_change_asks_to_resolve_conflicting_decisions():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm._get_task_convo = MagicMock()
+    convo = cm._get_task_convo.return_value.template.return_value.require_schema.return_value
+    convo.assistant.return_value = convo
+    cm.get_llm = MagicMock(
+        return_value=AsyncMock(
+            side_effect=[
+                ReviewChanges(
+                    hunks=[
+                        Hunk(number=1, reason="ok", decision="apply"),
+                        Hunk(number=2, reason="ok", decision="apply"),
+                        Hunk(number=2, reason="wrong", decision="ignore"),
+                    ],
+                    review_notes="",
+                ),
+                ReviewChanges(
+                    hunks=[
+                        Hunk(number=1, reason="ok", decision="apply"),
+                        Hunk(number=2, reason="wrong", decision="ignore"),
+                    ],
+                    review_notes="",
+                ),
+            ]
+        )
+    )
+
+    new_content = ORIGINAL.replace("return 1", "return 10").replace("return 3", "return 30")
+    approved_content, feedback = await cm.review_change("foo.py", "instructions", ORIGINAL, new_content)
+
+    assert approved_content == ORIGINAL.replace("return 1", "return 10")
+    assert feedback is None
+    assert "conflicting decisions for hunks: 2." in convo.user.call_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_review_hunks_reports_all_errors_at_once():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm._get_task_convo = MagicMock()
+    convo = cm._get_task_convo.return_value.template.return_value.require_schema.return_value
+    convo.assistant.return_value = convo
+    review = ReviewChanges(
+        hunks=[
+            Hunk(number=1, reason="ok", decision="apply"),
+            Hunk(number=1, reason="wrong", decision="ignore"),
+            Hunk(number=4, reason="ok", decision="apply"),
+        ],
+        review_notes="",
+    )
+    cm.get_llm = MagicMock(return_value=AsyncMock(return_value=review))
+
+    new_content = ORIGINAL.replace("return 1", "return 10").replace("return 3", "return 30")
+    hunks = CodeMonkey.get_diff_hunks(ORIGINAL, new_content)
+    assert await cm.review_hunks("foo.py", "instructions", ORIGINAL, hunks) is None
+
+    error = convo.user.call_args.args[0]
+    assert "you didn't review hunks: 2." in error
+    assert "there are no hunks 4." in error
+    assert "conflicting decisions for hunks: 1." in error
+
+
+@pytest.mark.asyncio
+async def test_precheck_hunks_disabled_by_default():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm.get_llm = MagicMock()
+
+    assert await cm.precheck_hunks("foo.py", "instructions", ["@@ -1 +1 @@"]) == set()
+    cm.get_llm.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("core.agents.code_monkey.get_config")
+async def test_precheck_hunks_failure_falls_back_to_full_review(mock_get_config):
+    mock_get_config.return_value.agent = {CODE_REVIEW_PRECHECK_AGENT_NAME: AgentLLMConfig()}
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm.get_llm = MagicMock(return_value=AsyncMock(side_effect=APIError("Error parsing LLM response")))
+
+    assert await cm.precheck_hunks("foo.py", "instructions", ["@@ -1 +1 @@"]) == set()
+
+
+@pytest.mark.asyncio
+@patch("core.agents.code_monkey.get_config")
+async def test_precheck_hunks_failure_does_not_ask_user(mock_get_config):
+    mock_get_config.return_value.agent = {CODE_REVIEW_PRECHECK_AGENT_NAME: AgentLLMConfig()}
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm.error_handler = AsyncMock(return_value=True)
+
+    class ClientUnderTest(BaseLLMClient):
+        provider = LLMProvider.OPENAI
+        _init_client = MagicMock()
+        _make_request = AsyncMock(return_value=("not a valid precheck", 10, 5))
+
+    with patch.object(BaseLLMClient, "for_provider", return_value=ClientUnderTest):
+        assert await cm.precheck_hunks("foo.py", "instructions", ["@@ -1 +1 @@"]) == set()
+
+    ClientUnderTest._make_request.assert_awaited_once()
+    cm.error_handler.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("core.agents.code_monkey.random.random", return_value=0.5)
+@patch("core.agents.code_monkey.get_config")
+async def test_review_change_with_precheck(mock_get_config, _mock_random):
+    mock_get_config.return_value.agent = {CODE_REVIEW_PRECHECK_AGENT_NAME: AgentLLMConfig()}
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    cm._get_task_convo = MagicMock()
+    precheck_llm = AsyncMock(
+        return_value=PrecheckChanges(
+            hunks=[
+                HunkPrecheck(number=1, verdict="yes"),
+                HunkPrecheck(number=2, verdict="unsure"),
+                HunkPrecheck(number=3, verdict="yes"),
+                HunkPrecheck(number=7, verdict="yes"),
+            ]
+        )
+    )
+    review_llm = AsyncMock(
+        return_value=ReviewChanges(
+            hunks=[Hunk(number=1, reason="wrong", decision="ignore")],
+            review_notes="",
+        )
+    )
+    cm.get_llm = MagicMock(side_effect=[precheck_llm, review_llm])
+
+    old_content = "".join(f"line {i}\n" for i in range(100))
+    new_content = (
+        old_content.replace("line 10\n", "line 10 changed\n")
+        .replace("line 50\n", "line 50 changed\n")
+        .replace("line 90\n", "line 90 changed\n")
+    )
+    approved_content, feedback = await cm.review_change("file.txt", "instructions", old_content, new_content)
+
+    assert approved_content == new_content.replace("line 50 changed\n", "line 50\n")
+    assert feedback is None
+    # Only the hunk that wasn't approved in the pre-check is sent to the reviewer
+    reviewed_hunks = cm._get_task_convo.return_value.template.call_args.kwargs["hunks"]
+    assert len(reviewed_hunks) == 1
+    assert "+line 50 changed" in reviewed_hunks[0]
+
+
+@pytest.mark.asyncio
+async def test_review_hunks_in_batches():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+
+    async def review_hunks(file_name, instructions, old_content, hunks):
+        return ReviewChanges(
+            hunks=[
+                Hunk(number=i + 1, reason=hunk, decision="apply" if "keep" in hunk else "ignore")
+                for i, hunk in enumerate(hunks)
+            ],
+            review_notes=f"{len(hunks)} hunks",
+        )
+
+    cm.review_hunks = AsyncMock(side_effect=review_hunks)
+    hunks = [f"hunk {i} {'keep' if i % 3 == 0 else 'drop'}" for i in range(10)]
+
+    review = await cm.review_hunks_in_batches("file.txt", "instructions", "", hunks)
+
+    assert [call.args[3] for call in cm.review_hunks.call_args_list] == [hunks[:8], hunks[8:]]
+    assert [(h.number, h.reason, h.decision) for h in review.hunks] == [
+        (i + 1, hunk, "apply" if i % 3 == 0 else "ignore") for i, hunk in enumerate(hunks)
+    ]
+    assert review.review_notes == "8 hunks\n\n2 hunks"
+
+
+@pytest.mark.asyncio
+async def test_review_hunks_in_batches_limits_parallel_requests():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    running = 0
+    max_running = 0
+
+    async def review_hunks(file_name, instructions, old_content, hunks):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0)
+        running -= 1
+        return ReviewChanges(hunks=[], review_notes="")
+
+    cm.review_hunks = AsyncMock(side_effect=review_hunks)
+
+    await cm.review_hunks_in_batches("file.txt", "instructions", "", [f"hunk {i}" for i in range(100)])
+    assert cm.review_hunks.call_count == 13
+    assert max_running == MAX_PARALLEL_REVIEW_BATCHES
+
+
+@pytest.mark.asyncio
+async def test_review_hunks_in_batches_falls_back_to_single_review():
+    cm = CodeMonkey(MagicMock(), MagicMock())
+    review = ReviewChanges(hunks=[], review_notes="")
+    cm.review_hunks = AsyncMock(side_effect=[review, None, review])
+    hunks = [f"hunk {i}" for i in range(10)]
+
+    assert await cm.review_hunks_in_batches("file.txt", "instructions", "", hunks) is review
+    assert cm.review_hunks.call_count == 3
+    assert cm.review_hunks.call_args.args[3] == hunks
+
+
+def test_apply_patch_and_revert():
+    old_content = "".join(f"line {i}\n" for i in range(100))
+    new_content = old_content.replace("line 5\n", "line 5 changed\nline 5 added\n").replace("line 95\n", "")
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+    patch = "--- file.txt\n+++ file.txt\n" + "\n".join(hunks) + "\n"
+
+    assert CodeMonkey._apply_patch(old_content, patch) == new_content
+    assert CodeMonkey._apply_patch(new_content, patch, revert=True) == old_content
+
+
+def test_get_old_content_context(monkeypatch):
+    monkeypatch.setattr("core.agents.code_monkey.REVIEW_CONTEXT_LINES", 2)
+    old_content = "".join(f"line {i}\n" for i in range(30))
+    new_content = (
+        old_content.replace("line 10\n", "line 10 changed\n")
+        .replace("line 12\n", "line 12 changed\n")
+        .replace("line 25\n", "")
+    )
+    hunks = CodeMonkey.get_diff_hunks(old_content, new_content)
+
+    assert CodeMonkey.get_old_content_context(old_content, hunks) == "".join(
+        [
+            "[... 5 unchanged lines not shown ...]\n",
+            *[f"line {i}\n" for i in range(5, 18)],
+            "[... 2 unchanged lines not shown ...]\n",
+            *[f"line {i}\n" for i in range(20, 30)],
+        ]
+    )
+
+
+def test_get_old_content_context_whole_file():
+    new_content = ORIGINAL.replace("return 2", "return 20")
+    hunks = CodeMonkey.get_diff_hunks(ORIGINAL, new_content)
+
+    assert CodeMonkey.get_old_content_context(ORIGINAL, hunks) == ORIGINAL
@@ -1,5 +1,6 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+import pytest
 from pydantic import BaseModel, Field
 
 from core.agents.convo import AgentConvo
@@ -41,3 +42,32 @@ def test_require_schema():
 
     assert len(convo.messages) == 2
     assert '"description": "User name"' in convo.messages[1]["content"]
+
+
+def test_system_template_reuses_render_for_same_state():
+    """Test that system_template() renders the template only once per project state."""
+    agent = MagicMock(agent_type="spec-writer")
+    agent.current_state.id = "state-1"
+
+    with patch.object(AgentConvo, "render", return_value="rendered") as mock_render:
+        AgentConvo(agent).system_template("ask_questions", foo="bar")
+        convo = AgentConvo(agent).system_template("ask_questions", foo="bar")
+        assert convo.messages[-1] == {"role": "system", "content": "rendered"}
+        # Once for each system prompt, and once for the template
+        assert mock_render.call_count == 3
+
+        AgentConvo(agent).system_template("ask_questions", foo="baz")
+        assert mock_render.call_count == 5
+
+        agent.current_state.id = "state-2"
+        AgentConvo(agent).system_template("ask_questions", foo="bar")
+        assert mock_render.call_count == 7
+
+
+def test_system_template_rejects_non_json_arguments():
+    agent = MagicMock(agent_type="spec-writer")
+    agent.current_state.id = "state-1"
+
+    with patch.object(AgentConvo, "render", return_value="rendered"):
+        with pytest.raises(TypeError):
+            AgentConvo(agent).system_template("ask_questions", foo=object())
@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import AsyncMock, Mock
 
 import pytest
@@ -97,3 +98,42 @@ async def test_import_if_deleted_files(agentcontext):
     assert state != sm.current_state
 
     assert len(sm.current_state.files) == 0
+
+
+def test_get_independent_save_file_steps():
+    sm = Mock()
+    sm.current_state.unfinished_steps = [
+        {"type": "save_file", "save_file": {"path": "a.py"}},
+        {"type": "save_file", "save_file": {"path": "b.py"}},
+        {"type": "save_file", "save_file": {"path": "a.py"}},
+        {"type": "save_file", "save_file": {"path": "c.py"}},
+    ]
+    orca = Orchestrator(state_manager=sm, ui=AsyncMock())
+
+    steps = orca.get_independent_save_file_steps()
+    assert [step["save_file"]["path"] for step in steps] == ["a.py", "b.py"]
+
+    sm.current_state.unfinished_steps.insert(1, {"type": "command", "command": {"command": "ls"}})
+    steps = orca.get_independent_save_file_steps()
+    assert [step["save_file"]["path"] for step in steps] == ["a.py"]
+
+
+@pytest.mark.asyncio
+async def test_run_parallel_agents_limits_concurrency(monkeypatch):
+    monkeypatch.setattr("core.agents.orchestrator.MAX_PARALLEL_AGENTS", 2)
+    running = 0
+    max_running = 0
+
+    async def run():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0)
+        running -= 1
+        return "done"
+
+    agents = [Mock(run=run) for _ in range(5)]
+    responses = await Orchestrator.run_parallel_agents(agents)
+
+    assert responses == ["done"] * 5
+    assert max_running == 2
@@ -219,3 +219,14 @@ async def test_completing_unfinished_epics(testdb):
     await testdb.refresh(state)
 
     assert state.current_epic is None
+
+
+@pytest.mark.parametrize("content", ["", "\n", "hello", "hello\nworld", "hello\nworld\n", "\n\nhello\n\n"])
+def test_file_content_line_count(content):
+    # For text with only `\n` line endings, this is the same as counting with splitlines()
+    assert FileContent(id="test", content=content).line_count == len(content.splitlines())
+
+
+@pytest.mark.parametrize("content", ["a\rb", "a\x0cb", "a\u2028b"])
+def test_file_content_line_count_only_counts_newlines(content):
+    assert FileContent(id="test", content=content).line_count == 1
@@ -0,0 +1,70 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from core.config import LLMConfig, LLMProvider
+from core.llm.anthropic_client import AnthropicClient
+from core.llm.convo import Convo
+
+
+@patch("core.llm.anthropic_client.AsyncAnthropic")
+def test_adapt_messages_moves_leading_system_messages(mock_AsyncAnthropic):
+    cfg = LLMConfig(provider=LLMProvider.ANTHROPIC, model="claude-3-haiku-20240307")
+    convo = (
+        Convo("system hello")
+        .system("static context")
+        .user("user hello")
+        .system("late system message")
+        .assistant("assistant hello")
+    )
+
+    llm = AnthropicClient(cfg)
+    system, messages = llm._adapt_messages(convo)
+
+    assert system == [
+        {"type": "text", "text": "system hello"},
+        {"type": "text", "text": "static context"},
+    ]
+    assert messages == [
+        {"role": "user", "content": "user hello\n\nlate system message"},
+        {"role": "assistant", "content": "assistant hello"},
+    ]
+
+
+@patch("core.llm.anthropic_client.AsyncAnthropic")
+def test_adapt_messages_only_system(mock_AsyncAnthropic):
+    cfg = LLMConfig(provider=LLMProvider.ANTHROPIC, model="claude-3-haiku-20240307")
+    convo = Convo("system hello")
+
+    llm = AnthropicClient(cfg)
+    system, messages = llm._adapt_messages(convo)
+
+    assert system == []
+    assert messages == [{"role": "user", "content": "system hello"}]
+
+
+@pytest.mark.asyncio
+@patch("core.llm.anthropic_client.AsyncAnthropic")
+async def test_stream_check_stops_generation(mock_AsyncAnthropic):
+    cfg = LLMConfig(provider=LLMProvider.ANTHROPIC, model="claude-3-haiku-20240307")
+    convo = Convo("system hello").user("user hello")
+
+    async def text_stream():
+        for chunk in ["hello", " world", " and more"]:
+            yield chunk
+
+    stream = MagicMock(text_stream=text_stream(), get_final_message=AsyncMock())
+    stream.current_message_snapshot.usage = MagicMock(
+        input_tokens=10,
+        output_tokens=1,
+        cache_creation_input_tokens=None,
+        cache_read_input_tokens=None,
+    )
+    mock_AsyncAnthropic.return_value.messages.stream.return_value.__aenter__.return_value = stream
+
+    llm = AnthropicClient(cfg)
+    response, req_log = await llm(convo, stream_check=lambda content: content != " world")
+
+    assert response == "hello world"
+    assert req_log.prompt_tokens == 10
+    stream.get_final_message.assert_not_awaited()
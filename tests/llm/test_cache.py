@@ -0,0 +1,74 @@
+from unittest.mock import AsyncMock
+
+import pytest
+
+from core.config import LLMConfig, LLMProvider
+from core.llm.base import BaseLLMClient
+from core.llm.cache import ResponseCache
+from core.llm.convo import Convo
+from core.llm.parser import JSONParser
+
+
+class ClientUnderTest(BaseLLMClient):
+    provider = LLMProvider.OPENAI
+
+    def _init_client(self):
+        pass
+
+
+def test_cache_key_depends_on_request():
+    convo = Convo("system").user("user")
+    key = ResponseCache.key("openai", "gpt-4o", 0, False, convo)
+
+    assert key == ResponseCache.key("openai", "gpt-4o", 0, False, Convo("system").user("user"))
+    assert key != ResponseCache.key("openai", "gpt-4o", 0.5, False, convo)
+    assert key != ResponseCache.key("openai", "gpt-4o-mini", 0, False, convo)
+    assert key != ResponseCache.key("openai", "gpt-4o", 0, True, convo)
+    assert key != ResponseCache.key("openai", "gpt-4o", 0, False, Convo("system").user("other user"))
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_size=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+
+    cache.set("c", "3")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_cached_response():
+    cfg = LLMConfig(model="gpt-4o")
+    llm = ClientUnderTest(cfg, response_cache=ResponseCache())
+    llm._make_request = AsyncMock(return_value=('{"hello": "world"}', 10, 5))
+
+    response, req_log = await llm(Convo("system").user("user"), temperature=0, parser=JSONParser())
+    assert response == {"hello": "world"}
+    assert req_log.prompt_tokens == 10
+
+    response, req_log = await llm(Convo("system").user("user"), temperature=0, parser=JSONParser())
+    assert response == {"hello": "world"}
+    assert req_log.response == '{"hello": "world"}'
+    assert req_log.prompt_tokens == 0
+    assert req_log.completion_tokens == 0
+
+    llm._make_request.assert_awaited_once()
+
+    await llm(Convo("system").user("different user"), temperature=0, parser=JSONParser())
+    assert llm._make_request.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_without_cache_always_calls_llm():
+    cfg = LLMConfig(model="gpt-4o")
+    llm = ClientUnderTest(cfg)
+    llm._make_request = AsyncMock(return_value=("hello", 10, 5))
+
+    await llm(Convo("system").user("user"))
+    await llm(Convo("system").user("user"))
+
+    assert llm._make_request.await_count == 2
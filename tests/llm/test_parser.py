@@ -199,6 +199,10 @@ def test_enum_parser(input, expected):
         ("watch this: `foo`", "watch this: `foo`"),
         ("`hello world`", "hello world"),
         ("```\nhello world\n```", "hello world"),
+        ("  ```py\nhello\nworld\n```\n", "hello\nworld"),
+        ("```\n```", ""),
+        ("```js\nconst a = `\n```\n`;\n```", "const a = `\n```\n`;"),
+        ("```py\nhello world```", "```py\nhello world```"),
     ],
 )
 def test_optional_block_parser(input, expected):
@@ -1,3 +1,5 @@
+from unittest.mock import MagicMock
+
 import pytest
 from jinja2 import UndefinedError
 
@@ -57,3 +59,10 @@ def test_jinja_file_template():
 def test_jinja_file_template_nonexistent_directory():
     with pytest.raises(ValueError):
         JinjaFileTemplate(["nonexistent"])
+
+
+def test_jinja_template_render_file_filter():
+    template = JinjaStringTemplate()
+    file = MagicMock(path="foo.py", content=MagicMock(content="a = 1\nb = 2\n", line_count=2))
+
+    assert template("{{ file|render_file }}", file=file) == "**`foo.py`** (2 lines of code):\n```\na = 1\nb = 2\n```\n"
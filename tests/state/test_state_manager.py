@@ -220,3 +220,34 @@ async def test_restoring_files_from_db(mock_get_config, tmpdir, testmanager):
         assert open(os.path.join(tmpdir, "test1", "file1.txt")).read() == "this is the content 1"
         assert open(os.path.join(tmpdir, "test1", "file2.txt")).read() == "this is the content 2"
         assert open(os.path.join(tmpdir, "test1", "file3.txt")).read() == "this is the content 3"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_get_modified_files(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir))
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test2")
+
+    async with testmanager as session:
+        session.add(project)
+        await sm.commit()
+        await sm.save_file("file1.txt", "this is the content 1")
+        await sm.save_file("file2.txt", "this is the content 2")
+        await sm.save_file("file3.txt", "this is the content 3")
+        await sm.commit()
+
+        os.remove(os.path.join(tmpdir, "test2", "file1.txt"))  # Remove the first file
+        with open(os.path.join(tmpdir, "test2", "file2.txt"), "a") as f:
+            f.write("modified")  # Change the second file
+        with open(os.path.join(tmpdir, "test2", "file4.txt"), "w") as f:
+            f.write("new file")  # Add a new file
+
+        assert sorted(await sm.get_modified_files()) == ["file1.txt", "file2.txt", "file4.txt"]
+
+        modified_files = await sm.get_modified_files_with_content()
+        assert sorted(modified_files, key=lambda f: f["path"]) == [
+            {"path": "file1.txt", "file_old": "this is the content 1", "file_new": ""},
+            {"path": "file2.txt", "file_old": "this is the content 2", "file_new": "this is the content 2modified"},
+            {"path": "file4.txt", "file_old": None, "file_new": "new file"},
+        ]